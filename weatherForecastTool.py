@@ -1,11 +1,12 @@
 """
 Weather Report and Forecast Application
 
-This Python script allows you to retrieve and share weather reports and forecasts for a given city. It leverages an weather API to fetch current weather data and forecast information.
+This Python script allows you to retrieve and share weather reports and forecasts for a given city. It leverages the OpenWeatherMap One Call API to fetch current weather data and forecast information in a single request.
 
 Prerequisites:
 - Python 3.x
-- pyowm, argparse, datetime modules
+- requests, requests_cache, argparse, datetime modules
+- orjson (optional, for faster JSON decoding)
 
 Usage:
 1. Set up an account and obtain an API key from a weather API provider.
@@ -14,6 +15,7 @@ Usage:
 4. The script will fetch the current weather report and display it, along with a forecast for +3 hours and rain, fog predictions next few days.
 
 Note: This script assumes a stable internet connection for accessing the weather API.
+The One Call API 3.0 requires a "One Call by Call" subscription on the OpenWeatherMap account.
 
 Running from command line:
 $ python weatherForecastTool.py -k <api_key> -c <city_name>
@@ -24,10 +26,49 @@ Author: Dementors
 Date: 05-June-2023
 """
 
-import pyowm
-from pyowm.utils import timestamps
 import argparse
-from datetime import datetime
+import bisect
+import functools
+import hashlib
+import time
+from datetime import datetime, timedelta, timezone
+from urllib.parse import parse_qs, urlsplit
+
+# use orjson, when available, to decode OpenWeatherMap responses faster
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# OpenWeatherMap refreshes its data roughly every 10 minutes
+CACHE_NAME = 'owm_cache'
+CACHE_EXPIRE_SECONDS = 600
+# city coordinates never change, geocoding responses are cached for good
+GEOCODING_URL_PATTERN = 'api.openweathermap.org/geo/*'
+# all OpenWeatherMap calls go to a single host, a small pool is enough
+HTTP_POOL_SIZE = 4
+
+# retry transient network errors a few times with exponential backoff
+REQUEST_TIMEOUT_SECONDS = 10
+RETRY_ATTEMPTS = 3
+RETRY_BACKOFF_SECONDS = 0.3
+
+# OpenWeatherMap endpoints
+GEOCODING_URL = 'https://api.openweathermap.org/geo/1.0/direct'
+ONE_CALL_URL = 'https://api.openweathermap.org/data/3.0/onecall'
+
+# OpenWeatherMap weather groups for rain, snow and fog
+RAIN_CONDITIONS = ('Rain', 'Drizzle', 'Thunderstorm')
+SNOW_CONDITIONS = ('Snow',)
+FOG_CONDITIONS = ('Fog', 'Mist', 'Haze', 'Smoke')
+
+# hour boundaries and labels for the time of day
+TIME_OF_DAY_BOUNDS = (6, 12, 18)
+TIME_OF_DAY_LABELS = ("Night", "Morning", "Afternoon", "Evening")
+
+# humidity boundaries and labels for the humidity level
+HUMIDITY_BOUNDS = (30, 60)
+HUMIDITY_LABELS = ("low", "medium", "high")
 
 
 # parse command line args
@@ -41,84 +82,124 @@ def cmd_line_parser():
     return args
 
 
-# get weather object
-def get_weather_obj(api_key):
-    # error handling for invalid API key
+# build the cache key for a request: appid is left out of the stored request,
+# so add a hash of it back to keep responses for different api keys apart
+def get_cache_key(request, **kwargs):
+    import requests_cache
+
+    api_key = parse_qs(urlsplit(request.url).query).get('appid', [''])[0]
+    api_key_hash = hashlib.sha256(api_key.encode()).hexdigest()
+    return f"{requests_cache.create_key(request, **kwargs)}-{api_key_hash}"
+
+
+# get the shared http session: keep-alive, gzip and an on-disk response cache
+@functools.lru_cache(maxsize=1)
+def get_http_session():
+    import requests_cache
+    from requests.adapters import HTTPAdapter
+
+    # cache OpenWeatherMap responses on disk so repeat runs skip the network,
+    # in the user cache dir, without storing the api key but keyed on its hash
+    session = requests_cache.CachedSession(CACHE_NAME, backend='sqlite', use_cache_dir=True,
+                                           expire_after=CACHE_EXPIRE_SECONDS,
+                                           urls_expire_after={GEOCODING_URL_PATTERN: requests_cache.NEVER_EXPIRE},
+                                           ignored_parameters=['appid'], key_fn=get_cache_key)
+    session.headers['Accept-Encoding'] = 'gzip, deflate'
+    session.mount('https://', HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE))
+    return session
+
+
+# call an OpenWeatherMap endpoint and return the decoded json
+def get_owm_json(url, params, unauthorized_message='Invalid API key'):
+    import requests
+
+    # error handling for transient network errors: retry, then give up
+    for attempt in range(RETRY_ATTEMPTS):
+        try:
+            resp = get_http_session().get(url, params=params, timeout=REQUEST_TIMEOUT_SECONDS)
+            break
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            if attempt == RETRY_ATTEMPTS - 1:
+                print("Could not reach the weather API. Please check your internet connection and try again.")
+                exit()
+            time.sleep(RETRY_BACKOFF_SECONDS * 2 ** attempt)
+
+    # error handling for invalid API key, or a key without access to this endpoint
+    if resp.status_code == 401:
+        print(unauthorized_message)
+        exit()
+    # error handling for other API errors, these fail fast
+    try:
+        resp.raise_for_status()
+    except requests.exceptions.HTTPError:
+        print(f"Weather API request failed with status {resp.status_code}")
+        exit()
+    # error handling for a response body that is not json
     try:
-        owm = pyowm.OWM(api_key)
-    except:
-        print('Invalid API key')
+        if orjson is not None:
+            return orjson.loads(resp.content)
+        return resp.json()
+    except ValueError:
+        print("Weather API returned an unreadable response")
         exit()
 
-    # use the pyowm API to get the current weather for a city
-    weather_manager = owm.weather_manager()
-    return weather_manager
+
+# get latitude and longitude of a city, memoized for the process and cached on disk without expiry
+@functools.lru_cache(maxsize=None)
+def geocode(city, api_key):
+    # error handling for invalid city name
+    try:
+        location = get_owm_json(GEOCODING_URL, {'q': city, 'limit': 1, 'appid': api_key})[0]
+        return location['lat'], location['lon']
+    except (KeyError, IndexError, TypeError):
+        print("Please enter a valid city name")
+        exit()
 
 
 def get_current_time():
-    # get current time in %Y-%m-%d %H:%M:%S format
-    curr_hour, curr_min = datetime.now().hour, datetime.now().minute
-    if curr_min >= 30:
-        curr_hour += 1
-    curr_time = datetime.now().replace(hour=curr_hour, minute=0, second=0, microsecond=0)
+    # get current time in %Y-%m-%d %H:%M:%S format, rounded to the nearest hour
+    now = datetime.now()
+    if now.minute >= 30:
+        now += timedelta(hours=1)
+    curr_time = now.replace(minute=0, second=0, microsecond=0)
     return curr_time
 
 
 def get_time_three_hours_later():
     curr_time = get_current_time()
-    future_time = curr_time.replace(hour=curr_time.hour + 3)
+    future_time = curr_time + timedelta(hours=3)
     return future_time
 
 
-def jump_to_entry():
-    three_hours_later = get_time_three_hours_later().hour
-    number_of_hours = three_hours_later - 9
-    return three_hours_later, int(number_of_hours / 3)
-
-
-# get weather or forecast of a city
-def get_weather(args, hours='0'):
-    weather_manager = get_weather_obj(args.api_key)
-    if hours == '0':
-        # error handling for invalid city name
-        try:
-            weather = weather_manager.weather_at_place(args.city).weather
-        except:
-            print("Please enter a valid city name")
-            exit()
-    else:
-        # error handling for invalid city name
-        try:
-            weather = weather_manager.forecast_at_place(args.city, hours).forecast
-        except:
-            print("Please enter a valid city name")
-            exit()
-
-    return weather
-
-
 # get current hour and min
 def get_curr_hour_min():
-    hr, mins = datetime.now().hour, datetime.now().minute
-    if mins < 10:
-        mins = f"0{mins}"
-    curr_time = f"{hr}:{mins}"
+    now = datetime.now()
+    hr, mins = now.hour, now.minute
+    curr_time = f"{hr:02d}:{mins:02d}"
     time_of_day = determine_time_of_day(hr)
     return curr_time, time_of_day
 
 
-# get weather details from weather object
-def get_weather_details(weather):
+# convert a unix timestamp to an iso formatted UTC time
+def to_iso_time(unix_time):
+    return datetime.fromtimestamp(unix_time, tz=timezone.utc).isoformat(sep=' ')
+
+
+# get weather details from the current and today's entries of a One Call response
+def get_weather_details(current, today):
     ref_time, time_of_day = get_curr_hour_min()
     weather_info_dict = {}
     # error handling
     try:
-        weather_info_dict = {'status': weather.status, 'detailed_status': weather.detailed_status,
-                             'sunrise_time': weather.sunrise_time(timeformat='iso'),
+        temperature = {'temp': current['temp'], 'feels_like': current['feels_like'],
+                       'temp_max': today['temp']['max'], 'temp_min': today['temp']['min']}
+        weather_info_dict = {'status': current['weather'][0]['main'],
+                             'detailed_status': current['weather'][0]['description'],
+                             'sunrise_time': to_iso_time(current['sunrise']),
                              'ref_time': ref_time,
-                             'sunset_time': weather.sunset_time(timeformat='iso'), 'humidity': weather.humidity,
-                             'temperature': weather.temperature(unit='celsius'), 'time_of_day': time_of_day}
-    except:
+                             'sunset_time': to_iso_time(current['sunset']), 'humidity': current['humidity'],
+                             'temperature': temperature, 'time_of_day': time_of_day}
+    except (KeyError, IndexError, TypeError, ValueError):
         print("Error occurred while fetching weather details")
         exit()
 
@@ -130,88 +211,72 @@ def get_weather_details(weather):
     return weather_info_dict
 
 
-# get forecast details from forecast object
-def get_forecast_details(forecast):
-    forecast_info_dict = {}
-    future_time_hour, jump_entries = jump_to_entry()
-    for each_time_stamp in forecast.weathers:
-        if jump_entries == 0:
-            break
-        jump_entries -= 1
-    # print(each_time_stamp)
-    forecast_info_dict = {'status': each_time_stamp.status, 'detailed_status': each_time_stamp.detailed_status,
-                          'reftime': future_time_hour}
-    return forecast_info_dict
+# fetch the One Call response for a location, memoized on (lat, lon, api key)
+@functools.lru_cache(maxsize=32)
+def fetch_one_call(lat, lon, api_key):
+    return get_owm_json(ONE_CALL_URL, {'lat': lat, 'lon': lon, 'appid': api_key,
+                                       'units': 'metric', 'exclude': 'minutely,alerts'},
+                        unauthorized_message='API key lacks the One Call 3.0 subscription')
 
 
-# get rain, snow, fog forecast for a city
-def get_rain_snow_fog_forecast(args):
-    rain_snow_fog_dict = {}
-    weather_manager = get_weather_obj(args.api_key)
-    forecast = weather_manager.forecast_at_place(args.city, '3h')
+# check whether any of the daily entries has one of the given weather conditions
+def has_condition(daily_entries, conditions):
+    return any(weather['main'] in conditions for day in daily_entries for weather in day['weather'])
 
-    tomorrow = timestamps.tomorrow()
-    rain_snow_fog_dict['rain'] = forecast.will_be_rainy_at(tomorrow)
-    rain_snow_fog_dict['snow'] = forecast.will_have_snow()
-    rain_snow_fog_dict['fog'] = forecast.will_have_fog()
-    return rain_snow_fog_dict
 
+# fetch current weather, +3 hours forecast and rain, snow, fog forecast with a single One Call request
+def fetch_and_parse(args):
+    lat, lon = geocode(args.city, args.api_key)
+    data = fetch_one_call(lat, lon, args.api_key)
 
-# determine morning, afternoon, evening from reference time
+    # error handling for a response with an unexpected shape
+    try:
+        ## Current
+        weather_info_dict = get_weather_details(data['current'], data['daily'][0])
+
+        ## Future - 3 hours
+        # hourly entries start at the current hour, index straight into the one 3 hours later
+        hourly = data['hourly']
+        future_time = get_time_three_hours_later()
+        idx = round((future_time.timestamp() - hourly[0]['dt']) / 3600)
+        each_time_stamp = hourly[idx] if 0 <= idx < len(hourly) else hourly[-1]
+        forecast_info_dict = {'status': each_time_stamp['weather'][0]['main'],
+                              'detailed_status': each_time_stamp['weather'][0]['description'],
+                              'reftime': future_time.hour}
+
+        ## Future - rain, snow, fog
+        rain_snow_fog_dict = {'rain': has_condition(data['daily'][1:2], RAIN_CONDITIONS),
+                              'snow': has_condition(data['daily'][1:], SNOW_CONDITIONS),
+                              'fog': has_condition(data['daily'][1:], FOG_CONDITIONS)}
+    except (KeyError, IndexError, TypeError, ValueError):
+        print("Error occurred while fetching weather details")
+        exit()
+
+    return weather_info_dict, forecast_info_dict, rain_snow_fog_dict
+
+
+# determine night, morning, afternoon, evening from reference time
 def determine_time_of_day(reference_time):
-    if 6 <= reference_time < 12:
-        return "Morning"
-    elif 12 <= reference_time < 18:
-        return "Afternoon"
-    elif 18 <= reference_time < 24:
-        return "Evening"
+    return TIME_OF_DAY_LABELS[bisect.bisect_right(TIME_OF_DAY_BOUNDS, reference_time)]
 
 
 # determine humidity low, medium or high
 def determine_humidity(humidity):
-    if humidity < 30:
-        return "low"
-    elif 30 <= humidity < 60:
-        return "medium"
-    else:
-        return "high"
-
-
-# convert all non string values to string
-def convert_to_string(weather_info_dict):
-    for key, value in weather_info_dict.items():
-        if not isinstance(value, str):
-            weather_info_dict[key] = str(value)
-    return weather_info_dict
+    return HUMIDITY_LABELS[bisect.bisect_right(HUMIDITY_BOUNDS, humidity)]
 
 
-# remove all fields with None value
-def remove_none_fields(weather_info_dict):
-    # error handling
-    if weather_info_dict == None:
-        return {}
-    old_weather_info_dict = weather_info_dict.copy()
-    for key, value in old_weather_info_dict.items():
-        if value == None or value == 'None':
-            del weather_info_dict[key]
-    return weather_info_dict
-
-
-# remove empty fields from weather details
-def remove_empty_fields(weather_info_dict):
-    old_weather_info_dict = weather_info_dict.copy()
-    for key, value in old_weather_info_dict.items():
-        if value == '' or value == {} or value == []:
-            del weather_info_dict[key]
-    return weather_info_dict
+# check whether a weather detail is None or empty
+def is_empty_value(value):
+    return value is None or value == 'None' or (isinstance(value, (dict, list, str)) and not value)
 
 
-# format the weather details
+# format the weather details: drop None/empty fields and convert the rest to string in one pass
 def format_weather_details(weather_info_dict):
-    weather_info_dict = remove_none_fields(weather_info_dict)
-    weather_info_dict = remove_empty_fields(weather_info_dict)
-    weather_info_dict = convert_to_string(weather_info_dict)
-    return weather_info_dict
+    # error handling
+    if not weather_info_dict:
+        return {}
+    return {key: value if isinstance(value, str) else str(value)
+            for key, value in weather_info_dict.items() if not is_empty_value(value)}
 
 
 # print the weather details beautifully
@@ -249,27 +314,11 @@ def main():
     # get command line args
     args = cmd_line_parser()
 
-    ## Current
-    # get weather for city
-    weather = get_weather(args)
-    # Error handling
-    if weather is None:
-        print("No weather details found for the city. Please check the city name and try again.")
-        exit(0)
-
-    # get weather details
-    weather_info_dict = get_weather_details(weather)
+    # get weather, forecast and rain, snow, fog details for city
+    weather_info_dict, forecast_info_dict, rain_snow_fog_dict = fetch_and_parse(args)
     # format weather details
     weather_info_dict = format_weather_details(weather_info_dict)
 
-    ## Future - 3 hours
-    # get forecast for city
-    forecast = get_weather(args, "3h")
-    # get weather details
-    forecast_info_dict = get_forecast_details(forecast)
-
-    ## Future - rain, snow, fog
-    rain_snow_fog_dict = get_rain_snow_fog_forecast(args)
     print_weather_details(args, weather_info_dict, forecast_info_dict, rain_snow_fog_dict)
 
 